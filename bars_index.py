@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+_initialized: set[Path] = set()
+_init_lock = threading.Lock()
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=3.0)
+    conn.row_factory = sqlite3.Row
+    if db_path not in _initialized:
+        with _init_lock:
+            if db_path not in _initialized:
+                conn.execute("PRAGMA journal_mode=WAL;")
+                # The octal parts lead the primary key, so a lookup is a single probe of the table's own b-tree.
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS decoded_codes (
+                        octal_part1 INTEGER NOT NULL,
+                        octal_part2 INTEGER NOT NULL,
+                        job_id TEXT NOT NULL,
+                        spot_type TEXT NOT NULL,
+                        spot_id TEXT NOT NULL,
+                        spotify_url TEXT NOT NULL,
+                        title TEXT,
+                        data_bars TEXT NOT NULL,
+                        updated_unix FLOAT NOT NULL,
+                        PRIMARY KEY (octal_part1, octal_part2, job_id)
+                    ) WITHOUT ROWID"""
+                )
+                _initialized.add(db_path)
+    return conn
+
+
+def store_decoded_code(db_path: Path, job_id: str, spotify_url: str, title: str | None, data_bars: list[int],
+                       octal_part1: int, octal_part2: int) -> None:
+    spot_type, spot_id = job_id.split("-", 1)
+    conn = _connect(db_path)
+    try:
+        with conn:
+            conn.execute(
+                """INSERT INTO decoded_codes (octal_part1, octal_part2, job_id, spot_type, spot_id, spotify_url,
+                                              title, data_bars, updated_unix)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (octal_part1, octal_part2, job_id) DO UPDATE SET
+                       title = COALESCE(excluded.title, title), updated_unix = excluded.updated_unix""",
+                (octal_part1, octal_part2, job_id, spot_type, spot_id, spotify_url, title,
+                 json.dumps(data_bars), time.time()))
+    finally:
+        conn.close()
+
+def lookup_decoded_code(db_path: Path, octal_part1: int, octal_part2: int) -> list[dict[str, ...]]:
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            """SELECT job_id, spot_type, spot_id, spotify_url, title, data_bars FROM decoded_codes
+               WHERE octal_part1 = ? AND octal_part2 = ?""",
+            (octal_part1, octal_part2))
+        return [{**dict(row), "data_bars": json.loads(row["data_bars"])} for row in rows]
+    finally:
+        conn.close()
+
+
+def backfill(db_path: Path, job_root: Path, debug: bool=False) -> int:
+    """Decodes the code image of every existing job and stores the result. Titles stay empty until the job is
+    requested again."""
+    from code_image_to_bars import get_encoded_bars_from_image
+    from job_storage import JOB_ID_PATTERN
+    from url_conversion import build_spotify_url
+
+    stored = 0
+    for code_img_path in [*job_root.glob("*/code_img.png"), *job_root.glob("*/*/*/code_img.png")]:
+        job_id = code_img_path.parent.name
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            continue
+
+        try:
+            bars_dto = get_encoded_bars_from_image(str(code_img_path), debug=False)
+        except Exception as e:
+            print(f"Skipping {job_id}: {e}")
+            continue
+
+        spot_type, spot_id = job_id.split("-", 1)
+        store_decoded_code(db_path, job_id, build_spotify_url(spot_type, spot_id), None, bars_dto.data_bars,
+                           bars_dto.octal_part1, bars_dto.octal_part2)
+        stored += 1
+        if debug:
+            print(f"Stored {job_id}: {bars_dto.octal_part1} {bars_dto.octal_part2}")
+
+    return stored
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Backfill the decoded code index from existing job code images")
+    parser.add_argument("--db-path", default=str(Path(__file__).parent / "db" / "codes.db"),
+                        help="Path to the decoded code database")
+    parser.add_argument("--job-root", default=str(Path(__file__).parent / "jobs"), help="Path to the jobs directory")
+    parser.add_argument("--debug", action="store_true", help="Enable debug output")
+
+    args = parser.parse_args()
+
+    db = Path(args.db_path).resolve()
+    db.parent.mkdir(parents=True, exist_ok=True)
+    print(f"Stored {backfill(db, Path(args.job_root).resolve(), debug=args.debug)} decoded codes")
@@ -143,11 +143,15 @@ def _encode_octal(values):
     return octal
 
 
-def get_encoded_bars_from_image(image_path: str, debug: bool=False, debug_dir: str="debug_outputs") -> SpotifyCodeBarsDTO:
-    data_bars = _get_bar_levels(image_path=image_path, debug=debug, debug_dir=debug_dir)
+def encode_bars(data_bars: list[int]) -> tuple[int, int]:
     octal = _encode_octal(data_bars)
     code_part1 = floor(octal / (8 ** 10))
     code_part2 = octal % (8 ** 10)
+    return code_part1, code_part2
+
+def get_encoded_bars_from_image(image_path: str, debug: bool=False, debug_dir: str="debug_outputs") -> SpotifyCodeBarsDTO:
+    data_bars = _get_bar_levels(image_path=image_path, debug=debug, debug_dir=debug_dir)
+    code_part1, code_part2 = encode_bars(data_bars)
 
     dto = SpotifyCodeBarsDTO(
         data_bars=data_bars,
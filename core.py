@@ -15,26 +15,61 @@ from starlette.responses import JSONResponse, FileResponse
 from pathlib import Path
 from logging.handlers import RotatingFileHandler
 import re
+import random
 import sqlite3
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from contextlib import asynccontextmanager
+from dataclasses import asdict
 
 from oembed_to_title import get_title
 from url_conversion import build_spotify_url
-from data_transfer_objects import SpotifyType, SpotifyCodeDTO
+from data_transfer_objects import AlbumImageColorDTO, SpotifyCodeBarsDTO, SpotifyType, SpotifyCodeDTO
 from oembed_to_album_image import save_album_data
 from url_to_code_image import save_spotify_code_data
 from album_image_to_colors import get_colors_from_image
-from code_image_to_bars import get_encoded_bars_from_image
+from code_image_to_bars import encode_bars, get_encoded_bars_from_image
 from url_to_oembed import get_oembed_data
+from job_queue import JobQueue
+from serialization import choose_encoding, compress, dumps_dto, read_result_cache, write_result_cache
+from image_variants import (VARIANT_FORMATS, VARIANT_SIZES, etag_matches, generate_variant, generate_variants,
+                            get_etag, variant_path, write_etag)
+from cpu_executor import CpuExecutor, CpuExecutorOverloaded
+from deadline import DEGRADED_RESPONSES, Deadline, OptionalStageRunner
+from job_storage import claim_job_dir, locate_job_dir
+from bars_index import lookup_decoded_code, store_decoded_code
+from request_stats import DAY, HOUR, create_schema, get_request_counts, get_top_items, log_request, run_compaction
+from profiling import PROFILE_MODES, PROFILE_MODE_SAMPLING, CollapsedAggregate, profile_call
 
 load_dotenv()
 
 IS_PRODUCTION = os.getenv("IS_PRODUCTION", "False").lower() in ("true", "1", "yes")
 EXTERNAL_ORIGIN = os.getenv("EXTERNAL_ORIGIN", "")
+ASYNC_JOBS = os.getenv("ASYNC_JOBS", "False").lower() in ("true", "1", "yes")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED", "True").lower() in ("true", "1", "yes")
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+REQUEST_LOG_RETENTION_DAYS = float(os.getenv("REQUEST_LOG_RETENTION_DAYS", "30"))
+HOURLY_STATS_RETENTION_DAYS = float(os.getenv("HOURLY_STATS_RETENTION_DAYS", "7"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) or None
+CPU_QUEUE_SIZE = int(os.getenv("CPU_QUEUE_SIZE")) if os.getenv("CPU_QUEUE_SIZE") else None
+CPU_RETRY_AFTER = int(os.getenv("CPU_RETRY_AFTER", "5"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "30"))
+CODE_DEADLINE_SECONDS = float(os.getenv("CODE_DEADLINE_SECONDS", "0")) or None
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "0")) or None
+OPTIONAL_STAGE_WORKERS = int(os.getenv("OPTIONAL_STAGE_WORKERS", "8"))
+OPTIONAL_STAGE_QUEUE_SIZE = int(os.getenv("OPTIONAL_STAGE_QUEUE_SIZE")) if os.getenv("OPTIONAL_STAGE_QUEUE_SIZE") else None
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
 
 JOB_DIR = Path(__file__).parent / "jobs"
 JOB_DIR = JOB_DIR.resolve()
 DB_DIR = Path(__file__).parent / "db"
 DB_DIR = DB_DIR.resolve()
+REQUESTS_DB_PATH = DB_DIR / "requests.db"
+CODES_DB_PATH = DB_DIR / "codes.db"
+PROFILE_AGGREGATE_PATH = Path("logs") / "profile_aggregate.folded"
 
 SPOTIFY_ID_PATTERN = re.compile(r'^[a-zA-Z0-9]{22}$')
 SPOTIFY_TYPE_PATTERN = re.compile(r'^(track|album|episode|playlist)$')
@@ -60,9 +95,36 @@ formatter = logging.Formatter(
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+cpu_executor = CpuExecutor(workers=CPU_WORKERS, queue_size=CPU_QUEUE_SIZE, retry_after=CPU_RETRY_AFTER,
+                           preload=["code_image_to_bars", "album_image_to_colors"])
+profile_aggregate = CollapsedAggregate(PROFILE_AGGREGATE_PATH)
+optional_stage_runner = OptionalStageRunner(workers=OPTIONAL_STAGE_WORKERS, queue_size=OPTIONAL_STAGE_QUEUE_SIZE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    DB_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        create_schema(REQUESTS_DB_PATH)
+    except sqlite3.Error as e:
+        logger.error(f"Database error creating the request log: {e}", exc_info=True)
+    if job_queue is not None:
+        job_queue.start()
+    compaction_stop = threading.Event()
+    threading.Thread(target=run_compaction, name="request-log-compaction", daemon=True,
+                     args=(REQUESTS_DB_PATH, compaction_stop, REQUEST_LOG_RETENTION_DAYS,
+                           HOURLY_STATS_RETENTION_DAYS)).start()
+    yield
+    compaction_stop.set()
+    if job_queue is not None:
+        job_queue.stop()
+    optional_stage_runner.shutdown()
+    profile_aggregate.flush()
+    cpu_executor.shutdown()
+
 app_kwargs = {
     "title": "Spotify Code API",
     "version": "1.0.2",
+    "lifespan": lifespan,
 }
 
 if IS_PRODUCTION:
@@ -84,7 +146,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-limiter = Limiter(key_func=get_remote_address, default_limits=["10/minute", "3/second"])
+limiter = Limiter(key_func=get_remote_address, default_limits=["10/minute", "3/second"], enabled=RATE_LIMITS_ENABLED,
+                  storage_uri=RATE_LIMIT_STORAGE_URI)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, lambda r, e: JSONResponse(
     status_code=429, content={"detail": "Too many requests, please try again later."}))
@@ -107,7 +170,7 @@ def server_health_check(request: Request):
 @app.get("/spotify/health/oembed")
 def oembed_health_check(request: Request):
     try:
-        get_oembed_data("https://open.spotify.com/track/0c6xIDDpzE81m2q797ordA", debug=False)
+        get_oembed_data("https://open.spotify.com/track/0c6xIDDpzE81m2q797ordA", debug=False, timeout=UPSTREAM_TIMEOUT)
         return {"status": "ok", "message": "oEmbed service is reachable"}
     except Exception as e:
         logger.error(f"oEmbed health check failed: {e}", exc_info=True)
@@ -116,77 +179,145 @@ def oembed_health_check(request: Request):
 @app.get("/spotify/code/{spotify_type}/{spotify_id}")
 @limiter.limit("10/minute")
 def get_spotify_code(spotify_id: str, spotify_type: SpotifyType, request: Request, response: Response):
-    result = process_request(spotify_id, spotify_type, response=response)
-    return result
-
-@app.get("/spotify/album/{job_id}/image")
-@limiter.limit("10/minute")
-def get_album_image(job_id: str, request: Request, response: Response):
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    profile_mode = get_profile_mode(request)
+
+    if profile_mode is None:
+        cached_response = get_cached_response(spotify_id, spotify_type, encoding)
+        if cached_response is not None:
+            return cached_response
+
+    if job_queue is not None:
+        return enqueue_request(spotify_id, spotify_type, request=request, response=response)
+
+    if profile_mode is None and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        result, _ = profile_call(lambda: process_request(spotify_id, spotify_type, response=response,
+                                                         budget=CODE_DEADLINE_SECONDS),
+                                 PROFILE_MODE_SAMPLING, aggregate=profile_aggregate)
+        return encode_result(result, encoding, response)
+
+    if profile_mode is not None:
+        job_id = f"{spotify_type.value}-{spotify_id}"
+        try:
+            sanitize_check_job_id(job_id)
+            output_dir = get_job_dir(job_id) / "debug_outputs"
+        except ValueError:
+            output_dir = None
+
+        result, top_functions = profile_call(lambda: process_request(spotify_id, spotify_type, response=response,
+                                                                     budget=CODE_DEADLINE_SECONDS),
+                                             profile_mode, output_dir=output_dir)
+        response.headers["X-Profile-Top"] = ", ".join(top_functions)
+        return encode_result(result, encoding, response)
+
+    result = process_request(spotify_id, spotify_type, response=response, budget=CODE_DEADLINE_SECONDS)
+    return encode_result(result, encoding, response)
+
+@app.get("/spotify/jobs/{job_id}")
+@limiter.limit("60/minute")
+def get_job_status(job_id: str, request: Request, response: Response):
     try:
         sanitize_check_job_id(job_id)
     except ValueError as e:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"detail": str(e)}
 
-    job_dir = JOB_DIR / job_id
-    image_path = job_dir / "album_img.jpeg"
+    if job_queue is None:
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"detail": "Asynchronous jobs are disabled"}
 
-    if not image_path.exists():
+    job_status = job_queue.get_status(job_id)
+    if job_status is None:
         response.status_code = status.HTTP_404_NOT_FOUND
-        return {"detail": "Album image not found"}
+        return {"detail": "Job not found"}
 
-    return FileResponse(
-        image_path,
-        media_type="image/jpeg",
-        # filename=f"album_img_{job_id}.png",
-        headers={"Cache-Control": "public, max-age=86400"}
-    )
+    return job_status
 
-@app.get("/spotify/pdf/{job_id}/a4")
-@limiter.limit("10/minute")
-def get_a4_pdf(job_id: str, request: Request, response: Response):
-    try:
-        sanitize_check_job_id(job_id)
-    except ValueError as e:
+@app.get("/spotify/lookup")
+@limiter.limit("30/minute")
+def lookup_code(request: Request, response: Response, bars: str | None=None, octal_part1: int | None=None,
+                octal_part2: int | None=None):
+    if bars is not None:
+        try:
+            data_bars = [int(bar) for bar in bars.split(",")]
+        except ValueError:
+            data_bars = []
+        if len(data_bars) != 20 or any(not 0 <= bar <= 7 for bar in data_bars):
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return {"detail": "bars must be 20 comma separated levels between 0 and 7"}
+        octal_part1, octal_part2 = encode_bars(data_bars)
+    elif octal_part1 is None or octal_part2 is None:
         response.status_code = status.HTTP_400_BAD_REQUEST
-        return {"detail": str(e)}
+        return {"detail": "Either bars or octal_part1 and octal_part2 are required"}
 
-    job_dir = JOB_DIR / job_id
-    pdf_path = job_dir / "a4.pdf"
+    try:
+        matches = lookup_decoded_code(CODES_DB_PATH, octal_part1, octal_part2)
+    except sqlite3.Error as e:
+        logger.error(f"Database error looking up decoded code: {e}", exc_info=True)
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"detail": "Code lookup is not available"}
 
-    if not pdf_path.exists():
+    if not matches:
         response.status_code = status.HTTP_404_NOT_FOUND
-        return {"detail": "A4 PDF not found"}
+        return {"detail": "No decoded code found"}
 
-    return FileResponse(
-        pdf_path,
-        media_type="application/pdf",
-        # filename=f"a4_{job_id}.pdf",
-        headers={"Cache-Control": "public, max-age=86400"}
-    )
+    return {"octal_part1": octal_part1, "octal_part2": octal_part2, "matches": matches}
+
+@app.get("/spotify/stats/top")
+@limiter.limit("30/minute")
+def get_top_stats(request: Request, response: Response, days: float=7.0, spotify_type: SpotifyType | None=None,
+                  limit: int=10):
+    if days <= 0 or not 1 <= limit <= 100:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"detail": "days must be positive and limit between 1 and 100"}
 
-@app.get("/spotify/pdf/{job_id}/minimal")
-@limiter.limit("10/minute")
-def get_minimal_pdf(job_id: str, request: Request, response: Response):
     try:
-        sanitize_check_job_id(job_id)
-    except ValueError as e:
+        items = get_top_items(REQUESTS_DB_PATH, time.time() - days * DAY,
+                              spotify_type.value if spotify_type else None, limit)
+    except sqlite3.Error as e:
+        logger.error(f"Database error reading top stats: {e}", exc_info=True)
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"detail": "Statistics are not available"}
+
+    return {"days": days, "items": items}
+
+@app.get("/spotify/stats/requests")
+@limiter.limit("30/minute")
+def get_request_stats(request: Request, response: Response, granularity: str="hour", hours: float=24.0):
+    if granularity not in ("hour", "day") or hours <= 0:
         response.status_code = status.HTTP_400_BAD_REQUEST
-        return {"detail": str(e)}
+        return {"detail": "granularity must be 'hour' or 'day' and hours must be positive"}
 
-    job_dir = JOB_DIR / job_id
-    pdf_path = job_dir / "minimal.pdf"
+    try:
+        counts = get_request_counts(REQUESTS_DB_PATH, granularity, time.time() - hours * HOUR)
+    except sqlite3.Error as e:
+        logger.error(f"Database error reading request stats: {e}", exc_info=True)
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"detail": "Statistics are not available"}
 
-    if not pdf_path.exists():
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"detail": "Minimal PDF not found"}
+    return {"granularity": granularity, "counts": counts}
 
-    return FileResponse(
-        pdf_path,
-        media_type="application/pdf",
-        # filename=f"minimal_{job_id}.pdf",
-        headers={"Cache-Control": "public, max-age=86400"}
-    )
+@app.get("/spotify/album/{job_id}/image")
+@limiter.limit("10/minute")
+def get_album_image(job_id: str, request: Request, response: Response, size: int | None=None,
+                    format: str="jpeg"):
+    if (size is not None and size not in VARIANT_SIZES) or format not in VARIANT_FORMATS:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"detail": f"size must be one of {list(VARIANT_SIZES)} and format one of {list(VARIANT_FORMATS)}"}
+
+    _, media_type = VARIANT_FORMATS[format]
+    return serve_job_file(job_id, "album_img.jpeg", media_type, "Album image not found", request, response,
+                          variant=(size, format))
+
+@app.get("/spotify/pdf/{job_id}/a4")
+@limiter.limit("10/minute")
+def get_a4_pdf(job_id: str, request: Request, response: Response):
+    return serve_job_file(job_id, "a4.pdf", "application/pdf", "A4 PDF not found", request, response)
+
+@app.get("/spotify/pdf/{job_id}/minimal")
+@limiter.limit("10/minute")
+def get_minimal_pdf(job_id: str, request: Request, response: Response):
+    return serve_job_file(job_id, "minimal.pdf", "application/pdf", "Minimal PDF not found", request, response)
 
 @app.exception_handler(Exception)
 async def unhandled(request: Request, exc: Exception):
@@ -194,7 +325,8 @@ async def unhandled(request: Request, exc: Exception):
     return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
 
 
-def process_request(spotify_id: str, spotify_type: SpotifyType, response: Response, debug: bool=False): #-> SpotifyCodeDTO |dict[str, str]:
+def process_request(spotify_id: str, spotify_type: SpotifyType, response: Response, debug: bool=False,
+                    budget: float | None=None, route: str="code"): #-> SpotifyCodeDTO |dict[str, str]:
     job_id = f"{spotify_type.value}-{spotify_id}"
     try:
         sanitize_check_job_id(job_id)
@@ -202,7 +334,13 @@ def process_request(spotify_id: str, spotify_type: SpotifyType, response: Respon
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"detail": str(e)}
 
-    job_dir = JOB_DIR / job_id
+    if cpu_executor.is_saturated():
+        return reject_overloaded(response, CpuExecutorOverloaded(cpu_executor.retry_after))
+
+    deadline = Deadline(budget)
+
+    # Not get_job_dir: a legacy directory could be moved by a running migration while the stages write into it.
+    job_dir = claim_job_dir(JOB_DIR, job_id)
     debug_dir = Path(job_dir) / "debug_outputs"
     debug_dir.mkdir(parents=True, exist_ok=True)
 
@@ -221,44 +359,59 @@ def process_request(spotify_id: str, spotify_type: SpotifyType, response: Respon
     regenerate_files = not (code_img_path.exists() and album_img_path.exists()
                             and pdf_a4_path.exists() and pdf_minimal_path.exists())
 
-    oembed_data = None
-    title = None
-    colors_dto = None
-
-    try:
-        oembed_data = get_oembed_data(spotify_url, debug=debug)
-    except Exception as e:
-        logger.error(f"Error fetching oEmbed data for {spotify_id}/{spotify_type}: {e}", exc_info=True)
+    # Title, album image, PDFs and colors are optional. With a budget they run next to the required bars and may
+    # outlive the request, without one (or with the background queue full) they run inline after the bars.
+    optional_future = None
+    if budget is not None:
+        # The background run is not bound to this request's budget, only its upstream calls are limited.
+        optional_future = optional_stage_runner.submit(job_id, lambda: run_optional_stages(
+            spotify_id, spotify_type, spotify_url, job_dir, regenerate_files, Deadline(None), debug))
 
     try:
         if regenerate_files:
-            save_spotify_code_data(spotify_url, str(code_img_path), debug=debug)
+            save_spotify_code_data(spotify_url, str(code_img_path), debug=debug,
+                                   timeout=deadline.timeout(UPSTREAM_TIMEOUT))
     except Exception as e:
         logger.error(f"Error fetching Spotify code data for {spotify_id}/{spotify_type}: {e}", exc_info=True)
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {"detail": f"An error occurred while fetching Spotify code data: {str(e)}"}
 
-    try:
-        if regenerate_files and oembed_data:
-            save_album_data(oembed_data, image_path=str(album_img_path), pdf_a4_path=str(pdf_a4_path),
-                            pdf_minimal_path=str(pdf_minimal_path), debug=debug)
-
-        if oembed_data:
-            title = get_title(oembed_data, debug=debug)
-    except Exception as e:
-        logger.warning(f"Error saving album data for {spotify_id}/{spotify_type}: {e}", exc_info=True)
+    if deadline.expired():
+        return reject_deadline_exceeded(response, spotify_id, spotify_type, budget)
 
     try:
-        bars_dto = get_encoded_bars_from_image(str(code_img_path), debug=debug, debug_dir=str(debug_dir))
+        bars_dto = cpu_executor.run(get_encoded_bars_from_image, str(code_img_path), debug=debug,
+                                    debug_dir=str(debug_dir), timeout=deadline.timeout())
+    except CpuExecutorOverloaded as e:
+        return reject_overloaded(response, e)
+    except FutureTimeoutError:
+        return reject_deadline_exceeded(response, spotify_id, spotify_type, budget)
     except Exception as e:
         logger.error(f"Error processing request for {spotify_id}/{spotify_type}: {e}", exc_info=True)
         response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
         return {"detail": f"An error occurred while processing the request: {str(e)}"}
 
-    try:
-        colors_dto = get_colors_from_image(str(album_img_path), debug=debug)
-    except Exception as e:
-        logger.warning(f"Error extracting colors from album image for {spotify_id}/{spotify_type}: {e}", exc_info=True)
+    title = None
+    colors_dto = None
+    pending = []
+
+    if optional_future is None:
+        title, colors_dto, pending = run_optional_stages(spotify_id, spotify_type, spotify_url, job_dir,
+                                                         regenerate_files, deadline, debug)
+        if pending:
+            DEGRADED_RESPONSES.labels(route=route).inc()
+            logger.warning(f"Time budget of {budget}s exceeded for {spotify_id}/{spotify_type}, skipped: {pending}")
+    else:
+        try:
+            title, colors_dto, _ = optional_future.result(timeout=deadline.remaining())
+        except FutureTimeoutError:
+            pending = get_pending_stages(album_img_path, pdf_a4_path, pdf_minimal_path)
+            DEGRADED_RESPONSES.labels(route=route).inc()
+            logger.warning(f"Time budget of {budget}s exceeded for {spotify_id}/{spotify_type}, pending: {pending}")
+            optional_future.add_done_callback(lambda future: finish_optional_stages(
+                future, job_id, spotify_id, spotify_type, spotify_url, bars_dto))
+
+    store_decoded_bars(job_id, spotify_url, title, bars_dto)
 
     spotify_code_dto = SpotifyCodeDTO(
         job_id=job_id,
@@ -267,40 +420,266 @@ def process_request(spotify_id: str, spotify_type: SpotifyType, response: Respon
         type=spotify_type.value,
         title=title,
         bars=bars_dto,
-        album_image_color=colors_dto
+        album_image_color=colors_dto,
+        pending=pending
     )
     return spotify_code_dto
 
+def run_optional_stages(spotify_id: str, spotify_type: SpotifyType, spotify_url: str, job_dir: Path,
+                        regenerate_files: bool, deadline: Deadline,
+                        debug: bool=False) -> tuple[str | None, AlbumImageColorDTO | None, list[str]]:
+    """Runs the optional stages, each only if the deadline has not expired yet. Returns the skipped stages last."""
+    album_img_path = job_dir / "album_img.jpeg"
+    pdf_a4_path = job_dir / "a4.pdf"
+    pdf_minimal_path = job_dir / "minimal.pdf"
+
+    oembed_data = None
+    title = None
+    colors_dto = None
+    skipped = []
+
+    if deadline.expired():
+        skipped.append("title")
+    else:
+        try:
+            oembed_data = get_oembed_data(spotify_url, debug=debug, timeout=deadline.timeout(UPSTREAM_TIMEOUT))
+            title = get_title(oembed_data, debug=debug)
+        except Exception as e:
+            logger.error(f"Error fetching oEmbed data for {spotify_id}/{spotify_type}: {e}", exc_info=True)
+
+    if regenerate_files and (skipped or deadline.expired()):
+        skipped.extend(get_missing_files(album_img_path, pdf_a4_path, pdf_minimal_path))
+    elif regenerate_files and oembed_data:
+        try:
+            save_album_data(oembed_data, image_path=str(album_img_path), pdf_a4_path=str(pdf_a4_path),
+                            pdf_minimal_path=str(pdf_minimal_path), debug=debug,
+                            timeout=deadline.timeout(UPSTREAM_TIMEOUT))
+            generate_variants(album_img_path, debug=debug)
+            write_etag(pdf_a4_path, debug=debug)
+            write_etag(pdf_minimal_path, debug=debug)
+        except Exception as e:
+            logger.warning(f"Error saving album data for {spotify_id}/{spotify_type}: {e}", exc_info=True)
+
+    if deadline.expired():
+        skipped.append("album_image_color")
+    else:
+        try:
+            colors_dto = cpu_executor.run(get_colors_from_image, str(album_img_path), debug=debug,
+                                          timeout=deadline.timeout())
+        except Exception as e:
+            logger.warning(f"Error extracting colors from album image for {spotify_id}/{spotify_type}: {e}",
+                           exc_info=True)
+
+    return title, colors_dto, skipped
+
+def get_pending_stages(album_img_path: Path, pdf_a4_path: Path, pdf_minimal_path: Path) -> list[str]:
+    return ["title", *get_missing_files(album_img_path, pdf_a4_path, pdf_minimal_path), "album_image_color"]
+
+def get_missing_files(album_img_path: Path, pdf_a4_path: Path, pdf_minimal_path: Path) -> list[str]:
+    missing = []
+    if not album_img_path.exists():
+        missing.append("album_image")
+    if not (pdf_a4_path.exists() and pdf_minimal_path.exists()):
+        missing.append("pdfs")
+    return missing
+
+def finish_optional_stages(future: Future, job_id: str, spotify_id: str, spotify_type: SpotifyType, spotify_url: str,
+                           bars_dto: SpotifyCodeBarsDTO) -> None:
+    if future.cancelled():
+        return
+
+    title, colors_dto, _ = future.result()
+    store_decoded_bars(job_id, spotify_url, title, bars_dto)
+
+    spotify_code_dto = SpotifyCodeDTO(
+        job_id=job_id,
+        spotify_url=spotify_url,
+        spotify_id=spotify_id,
+        type=spotify_type.value,
+        title=title,
+        bars=bars_dto,
+        album_image_color=colors_dto
+    )
+    if job_queue is not None:
+        # The queued job was stored with the degraded result, replace it with the one without pending stages.
+        try:
+            job_queue.update_result(job_id, status.HTTP_200_OK, asdict(spotify_code_dto))
+        except sqlite3.Error as e:
+            logger.error(f"Database error updating queued job {job_id}: {e}", exc_info=True)
+
+    # Cache the completed result so the next request for this job is answered without waiting.
+    cache_result(spotify_code_dto, dumps_dto(spotify_code_dto))
+
+def store_decoded_bars(job_id: str, spotify_url: str, title: str | None, bars_dto: SpotifyCodeBarsDTO) -> None:
+    try:
+        store_decoded_code(CODES_DB_PATH, job_id, spotify_url, title, bars_dto.data_bars,
+                           bars_dto.octal_part1, bars_dto.octal_part2)
+    except sqlite3.Error as e:
+        logger.error(f"Database error storing decoded code for {job_id}: {e}", exc_info=True)
+
+def enqueue_request(spotify_id: str, spotify_type: SpotifyType, request: Request, response: Response):
+    job_id = f"{spotify_type.value}-{spotify_id}"
+    try:
+        sanitize_check_job_id(job_id)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"detail": str(e)}
+
+    # Jobs whose files already exist finish quickly, so let them overtake cold ones.
+    priority = 1 if (get_job_dir(job_id) / "code_img.png").exists() else 0
+
+    try:
+        job_status = job_queue.enqueue(spotify_id, spotify_type, priority=priority)
+    except sqlite3.Error as e:
+        logger.error(f"Database error enqueueing job {job_id}: {e}", exc_info=True)
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"detail": "Job queue is not available"}
+
+    status_url = str(request.url_for("get_job_status", job_id=job_id))
+    response.status_code = status.HTTP_202_ACCEPTED
+    response.headers["Location"] = status_url
+    return {**job_status, "status_url": status_url}
+
+def get_cached_response(spotify_id: str, spotify_type: SpotifyType, encoding: str) -> Response | None:
+    job_id = f"{spotify_type.value}-{spotify_id}"
+    try:
+        sanitize_check_job_id(job_id)
+    except ValueError:
+        return None
+
+    job_dir = get_job_dir(job_id)
+    body = read_result_cache(job_dir, encoding, RESULT_CACHE_TTL)
+    if body is None:
+        return None
+
+    # Keep the job dir's mtime current like process_request does, so age based cleanups spare popular jobs.
+    # The cache files are not touched, their mtime is what RESULT_CACHE_TTL is measured against.
+    try:
+        now = time.time()
+        os.utime(job_dir, (now, now))
+    except OSError as e:
+        logger.warning(f"Error touching job dir of {job_id}: {e}")
+
+    log_to_db(spotify_id, spotify_type)
+    return json_bytes_response(body, encoding)
+
+def encode_result(result, encoding: str, response: Response):
+    if not isinstance(result, SpotifyCodeDTO):
+        return result
+
+    body = dumps_dto(result)
+    encoded_bodies = cache_result(result, body)
+    if encoded_bodies is not None:
+        return json_bytes_response(encoded_bodies[encoding], encoding, response)
+
+    return json_bytes_response(compress(body, encoding), encoding, response)
+
+def cache_result(result: SpotifyCodeDTO, body: bytes) -> dict[str, bytes] | None:
+    # Only complete results are cached, partial ones are retried on the next request.
+    if result.title is None or result.album_image_color is None:
+        return None
+
+    try:
+        return write_result_cache(get_job_dir(result.job_id), body)
+    except OSError as e:
+        logger.warning(f"Error caching result for {result.job_id}: {e}", exc_info=True)
+        return None
+
+def json_bytes_response(body: bytes, encoding: str, response: Response | None=None) -> Response:
+    headers = dict(response.headers) if response is not None else {}
+    headers.pop("content-length", None)
+    headers["Vary"] = "Accept-Encoding"
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    status_code = response.status_code if response is not None and response.status_code else status.HTTP_200_OK
+    return Response(content=body, status_code=status_code, media_type="application/json", headers=headers)
+
+def get_profile_mode(request: Request) -> str | None:
+    profile_mode = request.headers.get("X-Profile") or request.query_params.get("profile")
+    if profile_mode not in PROFILE_MODES:
+        return None
+
+    if IS_PRODUCTION and (not PROFILE_TOKEN or request.headers.get("X-Profile-Token") != PROFILE_TOKEN):
+        logger.warning(f"Rejected profiling request without valid token for {request.url}")
+        return None
+
+    return profile_mode
+
+def run_queued_job(spotify_id: str, spotify_type: SpotifyType) -> tuple[int, dict[str, ...]]:
+    response = Response()
+    result = process_request(spotify_id, spotify_type, response=response, budget=JOB_DEADLINE_SECONDS, route="job")
+    if isinstance(result, SpotifyCodeDTO):
+        # Cached like on the synchronous path, so the code endpoint answers later requests without a new job.
+        cache_result(result, dumps_dto(result))
+        return response.status_code, asdict(result)
+    return response.status_code, result
+
+job_queue = JobQueue(DB_DIR / "queue.db", run_queued_job, workers=JOB_WORKERS) if ASYNC_JOBS else None
+
+def serve_job_file(job_id: str, filename: str, media_type: str, not_found_detail: str, request: Request,
+                   response: Response, variant: tuple[int | None, str] | None=None):
+    try:
+        sanitize_check_job_id(job_id)
+    except ValueError as e:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"detail": str(e)}
+
+    file_path = get_job_dir(job_id) / filename
+
+    if not file_path.exists():
+        response.status_code = status.HTTP_404_NOT_FOUND
+        return {"detail": not_found_detail}
+
+    if variant is not None:
+        size, img_format = variant
+        original_path = file_path
+        file_path = variant_path(original_path, size, img_format)
+        if not file_path.exists():
+            # Jobs created before variants existed get theirs on first request.
+            try:
+                file_path = generate_variant(original_path, size, img_format)
+            except OSError as e:
+                logger.error(f"Error generating album image variant {file_path}: {e}", exc_info=True)
+                response.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+                return {"detail": "Album image variant could not be generated"}
+
+    etag = get_etag(file_path)
+    headers = {"Cache-Control": "public, max-age=86400", "ETag": etag}
+
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    return FileResponse(file_path, media_type=media_type, headers=headers)
+
+def reject_deadline_exceeded(response: Response, spotify_id: str, spotify_type: SpotifyType,
+                             budget: float | None) -> dict[str, str]:
+    logger.warning(f"Time budget of {budget}s exceeded before the code bars of {spotify_id}/{spotify_type} were ready")
+    response.status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    return {"detail": "The request took too long, please try again later."}
+
+def reject_overloaded(response: Response, e: CpuExecutorOverloaded) -> dict[str, str]:
+    logger.warning(f"Shedding request: {e}")
+    response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    response.headers["Retry-After"] = str(e.retry_after)
+    return {"detail": "Server is busy, please try again later."}
+
 def sanitize_check_job_id(job_id: str) -> None:
     parts = job_id.split("-")
     if (len(parts) != 2 or not SPOTIFY_TYPE_PATTERN.fullmatch(parts[0])
             or not SPOTIFY_ID_PATTERN.fullmatch(parts[1])):
         raise ValueError("Invalid job ID format")
 
-    job_dir = (JOB_DIR / job_id).resolve()
+    job_dir = get_job_dir(job_id).resolve()
 
     if not str(job_dir).startswith(str(JOB_DIR)):
         raise ValueError("Invalid job ID format or directory traversal attempt")
 
+def get_job_dir(job_id: str) -> Path:
+    return locate_job_dir(JOB_DIR, job_id)
+
 def log_to_db(spotify_id: str, spotify_type: SpotifyType) -> None:
-    db_path = DB_DIR / "requests.db"
     DB_DIR.mkdir(parents=True, exist_ok=True)
     try:
-        conn = sqlite3.connect(db_path, timeout=3.0)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        c = conn.cursor()
-        c.execute(
-            """CREATE TABLE IF NOT EXISTS requests (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp_str DATETIME DEFAULT CURRENT_TIMESTAMP,
-                timestamp_unix FLOAT,
-                spot_id TEXT,
-                spot_type TEXT
-            )"""
-        )
-        c.execute("INSERT INTO requests (timestamp_unix, spot_id, spot_type) VALUES (?, ?, ?)",
-                  (time.time(), spotify_id, spotify_type.value))
-        conn.commit()
-        conn.close()
+        log_request(REQUESTS_DB_PATH, spotify_id, spotify_type.value)
     except sqlite3.Error as e:
         logger.error(f"Database error inserting request {spotify_id}/{spotify_type}: {e}", exc_info=True)
@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from prometheus_client import Counter, Gauge, Histogram
+
+CPU_QUEUE_DEPTH = Gauge("cpu_executor_queue_depth", "CPU tasks admitted but not finished yet",
+                        multiprocess_mode="livesum")
+CPU_WAIT_SECONDS = Histogram("cpu_executor_wait_seconds", "Time CPU tasks wait for a free worker process")
+CPU_RUN_SECONDS = Histogram("cpu_executor_run_seconds", "Time CPU tasks run in a worker process")
+logger = logging.getLogger("spotify_code_api.cpu_executor")
+
+CPU_REJECTED = Counter("cpu_executor_rejected_total", "CPU tasks rejected because the admission queue was full")
+
+
+class CpuExecutorOverloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("CPU executor admission queue is full")
+        self.retry_after = retry_after
+
+
+def _timed_call(func: Callable[..., ...], args: tuple, kwargs: dict[str, ...]) -> tuple[..., float, float]:
+    started = time.time()
+    result = func(*args, **kwargs)
+    return result, started, time.time() - started
+
+
+class CpuExecutor:
+    """Bounded process pool for the CPU heavy pipeline stages (OpenCV decoding, KMeans color extraction).
+
+    At most workers + queue_size tasks are admitted at once. Further tasks are rejected right away with
+    CpuExecutorOverloaded instead of piling up behind the busy workers.
+
+    Where available, the worker processes are forked from a forkserver that imported the preload modules once,
+    so they share the pages of the heavy stacks instead of each importing them again.
+    """
+
+    def __init__(self, workers: int | None=None, queue_size: int | None=None, retry_after: int=5,
+                 preload: list[str] | None=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.limit = self.workers + (queue_size if queue_size is not None else 2 * self.workers)
+        self.retry_after = retry_after
+        self.preload = preload or []
+        self._admitted = 0
+        self._lock = threading.Lock()
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Workers only import the stage modules, not the web app with its threads. Both start methods
+                # begin from a fresh interpreter; the forkserver (POSIX only) does so once per process.
+                if "forkserver" in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context("forkserver")
+                    context.set_forkserver_preload(self.preload)
+                else:
+                    context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _discard_pool(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            # Another thread may already have replaced the broken pool.
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def is_saturated(self) -> bool:
+        return self._admitted >= self.limit
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._admitted >= self.limit:
+                CPU_REJECTED.inc()
+                raise CpuExecutorOverloaded(self.retry_after)
+            self._admitted += 1
+            CPU_QUEUE_DEPTH.set(self._admitted)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._admitted -= 1
+            CPU_QUEUE_DEPTH.set(self._admitted)
+
+    def run(self, func: Callable[..., ...], *args, timeout: float | None=None, **kwargs):
+        """Runs func(*args, **kwargs) in a worker process and blocks until its result is available.
+
+        Raises TimeoutError after timeout seconds. The task keeps its admission slot until the worker is done with it.
+        """
+        self._admit()
+        pool = None
+        future = None
+        try:
+            pool = self._get_pool()
+            submitted = time.time()
+            future = pool.submit(_timed_call, func, args, kwargs)
+            result, started, duration = future.result(timeout=timeout)
+            CPU_WAIT_SECONDS.observe(max(0.0, started - submitted))
+            CPU_RUN_SECONDS.observe(duration)
+            return result
+        except BrokenProcessPool:
+            # A worker process died (e.g. OOM killed). The pool cannot recover, so the next call builds a new one.
+            logger.error("CPU process pool is broken, discarding it", exc_info=True)
+            self._discard_pool(pool)
+            raise
+        except FutureTimeoutError:
+            # A task still waiting for a worker is dropped, a running one is left to finish.
+            future.cancel()
+            raise
+        finally:
+            if future is None:
+                self._release()
+            else:
+                future.add_done_callback(lambda _: self._release())
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
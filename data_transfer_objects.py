@@ -1,25 +1,25 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 
 
-@dataclass
+@dataclass(slots=True)
 class ColorDTO:
     rgb: tuple
     hex: str
     name: str
 
-@dataclass
+@dataclass(slots=True)
 class AlbumImageColorDTO:
     accent_color: ColorDTO
     code_color: ColorDTO
 
-@dataclass
+@dataclass(slots=True)
 class SpotifyCodeBarsDTO:
     data_bars: list[int]
     octal_part1: int
     octal_part2: int
 
-@dataclass
+@dataclass(slots=True)
 class SpotifyCodeDTO:
     job_id: str
     title: str
@@ -28,6 +28,7 @@ class SpotifyCodeDTO:
     spotify_url: str
     bars: SpotifyCodeBarsDTO
     album_image_color: AlbumImageColorDTO
+    pending: list[str] = field(default_factory=list)
 
 class SpotifyType(str, Enum):
     TRACK = "track"
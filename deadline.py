@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from prometheus_client import Counter
+
+DEGRADED_RESPONSES = Counter("degraded_responses_total",
+                             "Responses sent with optional stages still pending because the time budget ran out",
+                             ["route"])
+OPTIONAL_STAGES_SHED = Counter("optional_stages_shed_total",
+                               "Optional stage runs not moved to the background because its queue was full")
+
+
+class Deadline:
+    """Time budget of a single request. A budget of None never expires."""
+
+    def __init__(self, budget: float | None):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget if budget is not None else None
+
+    def remaining(self) -> float | None:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout(self, cap: float | None=None) -> float | None:
+        """Timeout for the next blocking call: the remaining budget, at most cap."""
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        return remaining if cap is None else min(cap, remaining)
+
+
+class OptionalStageRunner:
+    """Bounded thread pool for the optional stages that may outlive the request they were started for.
+
+    At most workers + queue_size jobs are admitted at once. Further submissions return None right away, the
+    caller then runs the stages itself within its own budget. A job whose stages are already admitted gets
+    the existing future instead of a second run.
+    """
+
+    def __init__(self, workers: int=8, queue_size: int | None=None):
+        self.workers = workers
+        self.limit = self.workers + (queue_size if queue_size is not None else self.workers)
+        self._futures: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._pool: ThreadPoolExecutor | None = None
+
+    def submit(self, job_id: str, stages: Callable[[], ...]) -> Future | None:
+        with self._lock:
+            future = self._futures.get(job_id)
+            if future is not None:
+                return future
+            if len(self._futures) >= self.limit:
+                OPTIONAL_STAGES_SHED.inc()
+                return None
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="optional-stage")
+            future = self._pool.submit(stages)
+            self._futures[job_id] = future
+
+        future.add_done_callback(lambda _: self._forget(job_id, future))
+        return future
+
+    def _forget(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            if self._futures.get(job_id) is future:
+                del self._futures[job_id]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            self._futures.clear()
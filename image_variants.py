@@ -0,0 +1,112 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+from PIL import Image
+
+VARIANT_SIZES = (64, 128, 256)
+VARIANT_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+ETAG_SUFFIX = ".etag"
+
+
+def variant_path(image_path: Path, size: int | None, img_format: str) -> Path:
+    if size is None and img_format == "jpeg":
+        return image_path
+    size_part = f"_{size}" if size is not None else ""
+    return image_path.with_name(f"{image_path.stem}{size_part}.{img_format}")
+
+def _etag_path(file_path: Path) -> Path:
+    return file_path.with_name(file_path.name + ETAG_SUFFIX)
+
+def _write_atomically(output_path: Path, write: Callable[[Path], None]) -> None:
+    # A unique temporary file per writer, so concurrent first requests for the same file do not collide.
+    fd, tmp_name = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix=".tmp")
+    os.close(fd)
+    tmp_path = Path(tmp_name)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+def write_etag(file_path: Path, debug: bool=False) -> str:
+    digest = hashlib.sha256(file_path.read_bytes()).hexdigest()[:32]
+    etag = f'"{digest}"'
+    _write_atomically(_etag_path(file_path), lambda tmp_path: tmp_path.write_text(etag, encoding="ascii"))
+
+    if debug:
+        print(f"ETag {etag} written for {file_path}")
+
+    return etag
+
+def get_etag(file_path: Path) -> str:
+    """Returns the precomputed strong ETag of a file and computes it once if it is missing or outdated."""
+    etag_path = _etag_path(file_path)
+    try:
+        if etag_path.stat().st_mtime >= file_path.stat().st_mtime:
+            return etag_path.read_text(encoding="ascii")
+    except FileNotFoundError:
+        pass
+
+    try:
+        return write_etag(file_path)
+    except OSError:
+        # Another request may have just written it.
+        return etag_path.read_text(encoding="ascii")
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return etag in candidates
+
+
+def _save_variant(image: Image.Image, output_path: Path, size: int | None, img_format: str) -> None:
+    variant = image.copy()
+    if size is not None:
+        variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+    pil_format, _ = VARIANT_FORMATS[img_format]
+    _write_atomically(output_path, lambda tmp_path: variant.save(tmp_path, format=pil_format, quality=85))
+
+def generate_variant(image_path: Path, size: int | None, img_format: str, debug: bool=False) -> Path:
+    output_path = variant_path(image_path, size, img_format)
+    with Image.open(image_path) as image:
+        _save_variant(image.convert("RGB"), output_path, size, img_format)
+    write_etag(output_path)
+
+    if debug:
+        print(f"Album image variant saved to {output_path}")
+
+    return output_path
+
+def generate_variants(image_path: Path, debug: bool=False) -> None:
+    """Writes every size and format variant of an album image next to it together with the ETags."""
+    with Image.open(image_path) as image:
+        rgb_image = image.convert("RGB")
+        for img_format in VARIANT_FORMATS:
+            for size in (None, *VARIANT_SIZES):
+                output_path = variant_path(image_path, size, img_format)
+                if output_path == image_path:
+                    continue
+                _save_variant(rgb_image, output_path, size, img_format)
+                write_etag(output_path)
+    write_etag(image_path)
+
+    if debug:
+        print(f"Album image variants written for {image_path}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate the size and format variants of an album image")
+    parser.add_argument("image_path", help="Path to the album image")
+    parser.add_argument("--debug", action="store_true", help="Enable debug output")
+
+    args = parser.parse_args()
+
+    generate_variants(Path(args.image_path), debug=args.debug)
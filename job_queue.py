@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable
+
+from data_transfer_objects import SpotifyType
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+logger = logging.getLogger("spotify_code_api.job_queue")
+
+JobHandler = Callable[[str, SpotifyType], tuple[int, dict[str, ...]]]
+
+
+class JobQueue:
+    """Persistent sqlite backed queue of Spotify code jobs drained by a pool of worker threads.
+
+    Jobs are keyed by their job_id, so enqueueing a job that is already queued, running or
+    recently finished does not schedule it a second time.
+    """
+
+    def __init__(self, db_path: Path, handler: JobHandler, workers: int=2, result_ttl: float=3600.0,
+                 stale_after: float=300.0, poll_interval: float=0.5):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._instance = uuid.uuid4().hex
+        self._last_stale_check = 0.0
+        self._stale_check_lock = threading.Lock()
+        self._create_table()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=3.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _create_table(self) -> None:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS job_queue (
+                    job_id TEXT PRIMARY KEY,
+                    spot_id TEXT NOT NULL,
+                    spot_type TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    enqueued_unix FLOAT NOT NULL,
+                    started_unix FLOAT,
+                    finished_unix FLOAT,
+                    status_code INTEGER,
+                    result TEXT,
+                    worker TEXT
+                )"""
+            )
+            columns = [row["name"] for row in conn.execute("PRAGMA table_info(job_queue)")]
+            if "worker" not in columns:
+                conn.execute("ALTER TABLE job_queue ADD COLUMN worker TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_queue_pending "
+                         "ON job_queue (status, priority DESC, enqueued_unix)")
+        finally:
+            conn.close()
+
+    def enqueue(self, spotify_id: str, spotify_type: SpotifyType, priority: int=0) -> dict[str, ...]:
+        job_id = f"{spotify_type.value}-{spotify_id}"
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT status, finished_unix FROM job_queue WHERE job_id = ?",
+                               (job_id,)).fetchone()
+
+            if row is None:
+                conn.execute(
+                    """INSERT INTO job_queue (job_id, spot_id, spot_type, priority, status, enqueued_unix)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (job_id, spotify_id, spotify_type.value, priority, STATUS_QUEUED, now))
+            elif row["status"] == STATUS_QUEUED:
+                conn.execute("UPDATE job_queue SET priority = MAX(priority, ?) WHERE job_id = ?",
+                             (priority, job_id))
+            elif row["status"] == STATUS_FAILED or (row["status"] == STATUS_DONE
+                                                    and now - row["finished_unix"] > self.result_ttl):
+                conn.execute(
+                    """UPDATE job_queue SET status = ?, priority = ?, enqueued_unix = ?, started_unix = NULL,
+                       finished_unix = NULL, status_code = NULL, result = NULL WHERE job_id = ?""",
+                    (STATUS_QUEUED, priority, now, job_id))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        self._wakeup.set()
+        return self.get_status(job_id)
+
+    def get_status(self, job_id: str) -> dict[str, ...] | None:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM job_queue WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+
+            status = {
+                "job_id": job_id,
+                "status": row["status"],
+                "enqueued_unix": row["enqueued_unix"],
+                "started_unix": row["started_unix"],
+                "finished_unix": row["finished_unix"],
+            }
+            if row["status"] == STATUS_QUEUED:
+                ahead = conn.execute(
+                    """SELECT COUNT(*) FROM job_queue WHERE status = ?
+                       AND (priority > ? OR (priority = ? AND enqueued_unix < ?))""",
+                    (STATUS_QUEUED, row["priority"], row["priority"], row["enqueued_unix"])).fetchone()[0]
+                status["queue_position"] = ahead + 1
+            if row["status"] in (STATUS_DONE, STATUS_FAILED):
+                status["status_code"] = row["status_code"]
+                status["result"] = json.loads(row["result"]) if row["result"] else None
+            return status
+        finally:
+            conn.close()
+
+    def _claim_next(self) -> sqlite3.Row | None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                """SELECT job_id, spot_id, spot_type FROM job_queue WHERE status = ?
+                   ORDER BY priority DESC, enqueued_unix LIMIT 1""",
+                (STATUS_QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE job_queue SET status = ?, started_unix = ?, worker = ? WHERE job_id = ?",
+                             (STATUS_RUNNING, time.time(), self._worker_id(), row["job_id"]))
+            conn.execute("COMMIT")
+            return row
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id: str, status_code: int, payload: dict[str, ...]) -> None:
+        status = STATUS_DONE if status_code < 400 else STATUS_FAILED
+        conn = self._connect()
+        try:
+            # A job already finished by update_result keeps that (more complete) result.
+            conn.execute("UPDATE job_queue SET status = ?, finished_unix = ?, status_code = ?, result = ? "
+                         "WHERE job_id = ? AND status = ?",
+                         (status, time.time(), status_code, json.dumps(payload), job_id, STATUS_RUNNING))
+        finally:
+            conn.close()
+
+    def update_result(self, job_id: str, status_code: int, payload: dict[str, ...]) -> None:
+        """Replaces the result of a running or done job, e.g. once its optional stages finished in the background.
+
+        Jobs that were re-queued in the meantime are left alone, their next run produces a fresh result.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE job_queue SET status = ?, finished_unix = ?, status_code = ?, result = ? "
+                         "WHERE job_id = ? AND status IN (?, ?)",
+                         (STATUS_DONE, time.time(), status_code, json.dumps(payload), job_id, STATUS_RUNNING,
+                          STATUS_DONE))
+        finally:
+            conn.close()
+
+    def _worker_id(self) -> str:
+        # The pid is read on every claim so forked processes record their own.
+        return f"{socket.gethostname()}:{os.getpid()}:{self._instance}"
+
+    def _requeue_stale(self) -> None:
+        conn = self._connect()
+        try:
+            cursor = conn.execute("UPDATE job_queue SET status = ?, started_unix = NULL, worker = NULL "
+                                  "WHERE status = ? AND started_unix < ?",
+                                  (STATUS_QUEUED, STATUS_RUNNING, time.time() - self.stale_after))
+            if cursor.rowcount:
+                logger.warning(f"Re-queued {cursor.rowcount} stale running jobs")
+        finally:
+            conn.close()
+
+    def _requeue_stale_periodically(self) -> None:
+        with self._stale_check_lock:
+            if time.time() - self._last_stale_check < self.stale_after / 2:
+                return
+            self._last_stale_check = time.time()
+        self._requeue_stale()
+
+    def _requeue_orphaned(self) -> None:
+        """Re-queues jobs claimed on this host by a process that no longer runs, e.g. before a restart."""
+        hostname = socket.gethostname()
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT job_id, worker FROM job_queue WHERE status = ? AND worker LIKE ?",
+                                (STATUS_RUNNING, f"{hostname}:%")).fetchall()
+            orphaned = []
+            for row in rows:
+                _, pid, instance = row["worker"].rsplit(":", 2)
+                # A reused pid (e.g. pid 1 in a restarted container) is recognized by the other instance id.
+                if instance != self._instance and (int(pid) == os.getpid() or not _is_process_alive(int(pid))):
+                    orphaned.append(row["job_id"])
+
+            for job_id in orphaned:
+                conn.execute("UPDATE job_queue SET status = ?, started_unix = NULL, worker = NULL "
+                             "WHERE job_id = ? AND status = ?", (STATUS_QUEUED, job_id, STATUS_RUNNING))
+            if orphaned:
+                logger.warning(f"Re-queued {len(orphaned)} jobs orphaned by a previous process")
+        finally:
+            conn.close()
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                row = self._claim_next()
+            except sqlite3.Error as e:
+                logger.error(f"Database error claiming queued job: {e}", exc_info=True)
+                row = None
+
+            if row is None:
+                try:
+                    self._requeue_stale_periodically()
+                except sqlite3.Error as e:
+                    logger.error(f"Database error re-queueing stale jobs: {e}", exc_info=True)
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            job_id = row["job_id"]
+            try:
+                status_code, payload = self.handler(row["spot_id"], SpotifyType(row["spot_type"]))
+            except Exception as e:
+                logger.error(f"Unhandled error running queued job {job_id}: {e}", exc_info=True)
+                status_code, payload = 500, {"detail": "Internal Server Error"}
+
+            try:
+                self._finish(job_id, status_code, payload)
+            except sqlite3.Error as e:
+                logger.error(f"Database error finishing queued job {job_id}: {e}", exc_info=True)
+
+    def start(self) -> None:
+        # A new instance id per start, so forked workers sharing this object claim jobs under their own id.
+        self._instance = uuid.uuid4().hex
+        self._requeue_orphaned()
+        self._requeue_stale()
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} job queue workers")
+
+    def stop(self, timeout: float=5.0) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
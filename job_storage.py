@@ -0,0 +1,112 @@
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+
+JOB_ID_PATTERN = re.compile(r'^(track|album|episode|playlist)-[a-zA-Z0-9]{22}$')
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def sharded_job_dir(job_root: Path, job_id: str) -> Path:
+    digest = hashlib.sha1(job_id.encode("ascii")).hexdigest()
+    shards = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return job_root.joinpath(*shards, job_id)
+
+def legacy_job_dir(job_root: Path, job_id: str) -> Path:
+    return job_root / job_id
+
+def locate_job_dir(job_root: Path, job_id: str) -> Path:
+    """Returns the directory of a job in the sharded layout.
+
+    Jobs that have not been migrated yet are still found in the flat legacy layout, new jobs always go to the
+    sharded layout.
+    """
+    sharded = sharded_job_dir(job_root, job_id)
+    if sharded.exists():
+        return sharded
+
+    legacy = legacy_job_dir(job_root, job_id)
+    if legacy.exists():
+        return legacy
+
+    return sharded
+
+def claim_job_dir(job_root: Path, job_id: str) -> Path:
+    """Returns the sharded directory of a job that is about to be written, moving a legacy directory there first.
+
+    Writers always work in the sharded directory, so a migration running at the same time cannot move their
+    files away mid-request.
+    """
+    sharded = sharded_job_dir(job_root, job_id)
+    legacy = legacy_job_dir(job_root, job_id)
+    if legacy.is_dir():
+        _move_job_dir(legacy, sharded)
+    return sharded
+
+
+def _merge_into(source: Path, target: Path) -> None:
+    try:
+        entries = list(source.iterdir())
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        destination = target / entry.name
+        try:
+            if entry.is_dir() and destination.is_dir():
+                _merge_into(entry, destination)
+            elif not destination.exists():
+                os.replace(entry, destination)
+        except FileNotFoundError:
+            # Moved by a request or another migration in the meantime.
+            continue
+    shutil.rmtree(source, ignore_errors=True)
+
+def _move_job_dir(source: Path, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.rename(source, target)
+    except FileNotFoundError:
+        # Moved by a request or another migration in the meantime.
+        return
+    except OSError:
+        if not target.is_dir():
+            raise
+        _merge_into(source, target)
+
+def migrate_job_dirs(job_root: Path, debug: bool=False) -> int:
+    """Moves all jobs of the flat legacy layout into the sharded layout while the service keeps running.
+
+    Each job is moved with a single rename on the same filesystem. If the service already created the sharded
+    directory in the meantime, the files missing there are moved over and the legacy directory is removed.
+    Requests that write a job move it themselves first (see claim_job_dir), so only readers can still see a file
+    vanish mid-request: an image or PDF download racing the move of its job may fail once and succeed on retry.
+    """
+    migrated = 0
+    for entry in job_root.iterdir():
+        if not entry.is_dir() or not JOB_ID_PATTERN.fullmatch(entry.name):
+            continue
+
+        target = sharded_job_dir(job_root, entry.name)
+        _move_job_dir(entry, target)
+
+        migrated += 1
+        if debug:
+            print(f"Moved {entry} to {target}")
+
+    return migrated
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Migrate the flat jobs directory into the hash-sharded layout")
+    parser.add_argument("job_root", nargs="?", default=str(Path(__file__).parent / "jobs"),
+                        help="Path to the jobs directory")
+    parser.add_argument("--debug", action="store_true", help="Enable debug output")
+
+    args = parser.parse_args()
+
+    count = migrate_job_dirs(Path(args.job_root).resolve(), debug=args.debug)
+    print(f"Migrated {count} jobs")
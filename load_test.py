@@ -0,0 +1,98 @@
+import random
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def _random_spotify_id() -> str:
+    return "".join(random.choices(string.ascii_letters + string.digits, k=22))
+
+def _percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _request_code(session: requests.Session, base_url: str, spotify_type: str, spotify_id: str,
+                  timeout: float) -> tuple[float, bool]:
+    started = time.perf_counter()
+    try:
+        response = session.get(f"{base_url}/spotify/code/{spotify_type}/{spotify_id}", timeout=timeout)
+        ok = response.status_code in (200, 202)
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+def run_level(base_url: str, concurrency: int, total_requests: int, spotify_ids: list[str],
+              spotify_type: str="track", timeout: float=30.0) -> dict[str, float]:
+    """Sends total_requests code requests with the given concurrency and summarizes latency and errors."""
+    local = threading.local()
+
+    def send(i: int) -> tuple[float, bool]:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return _request_code(local.session, base_url, spotify_type, spotify_ids[i % len(spotify_ids)], timeout)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(total_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, ok in results if not ok)
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "throughput_rps": total_requests / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "error_rate": errors / total_requests if total_requests else 0.0,
+    }
+
+def run(base_url: str, concurrency_levels: list[int], requests_per_level: int, warm_ids: int=10,
+        spotify_type: str="track", timeout: float=30.0) -> list[dict[str, ...]]:
+    """Runs every concurrency level against cold (never seen) and warm (already processed) jobs.
+
+    Cold runs use fresh random Spotify IDs, which the stub upstream answers with its default recording.
+    """
+    warm_spotify_ids = [_random_spotify_id() for _ in range(warm_ids)]
+    session = requests.Session()
+    for spotify_id in warm_spotify_ids:
+        _request_code(session, base_url, spotify_type, spotify_id, timeout)
+
+    reports = []
+    for concurrency in concurrency_levels:
+        cold_spotify_ids = [_random_spotify_id() for _ in range(requests_per_level)]
+        for cache, spotify_ids in (("cold", cold_spotify_ids), ("warm", warm_spotify_ids)):
+            report = run_level(base_url, concurrency, requests_per_level, spotify_ids, spotify_type, timeout)
+            report["cache"] = cache
+            reports.append(report)
+    return reports
+
+def print_reports(reports: list[dict[str, ...]]) -> None:
+    print(f"{'cache':<6} {'conc':>5} {'reqs':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for report in reports:
+        print(f"{report['cache']:<6} {report['concurrency']:>5} {report['requests']:>6} "
+              f"{report['throughput_rps']:>8.1f} {report['p50_ms']:>9.1f} {report['p95_ms']:>9.1f} "
+              f"{report['p99_ms']:>9.1f} {report['error_rate']:>7.1%}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Drive the Spotify Code API at set concurrency levels")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000", help="Base URL of the running API")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level and cache state")
+    parser.add_argument("--warm-ids", type=int, default=10, help="Number of distinct jobs used for the warm runs")
+    parser.add_argument("--type", default="track", help="Spotify type used for the generated jobs")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout per request in seconds")
+
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    print_reports(run(args.base_url, levels, args.requests, args.warm_ids, args.type, args.timeout))
@@ -10,8 +10,8 @@ def _get_thumbnail_url(oembed_data: dict[str, ...], debug: bool=False) -> str:
     else:
         raise KeyError("Thumbnail URL not found in oEmbed data")
 
-def _request_album_image(thumbnail_url: str, debug: bool=False) -> bytes:
-    response = requests.get(thumbnail_url)
+def _request_album_image(thumbnail_url: str, debug: bool=False, timeout: float | None=None) -> bytes:
+    response = requests.get(thumbnail_url, timeout=timeout)
     if response.status_code == 200:
         if debug:
             print(f"Successfully retrieved album image from URL: {thumbnail_url}")
@@ -51,9 +51,9 @@ def _write_pdf_with_image_a4(image_path: str, output_path: str, size_mm: int=20,
 
 
 def save_album_data(oembed_data: dict[str, ...], image_path: str, pdf_a4_path: str=None,
-                    pdf_minimal_path: str=None, debug: bool=False) -> None:
+                    pdf_minimal_path: str=None, debug: bool=False, timeout: float | None=None) -> None:
     thumbnail_url = _get_thumbnail_url(oembed_data, debug=debug)
-    thumbnail = _request_album_image(thumbnail_url, debug=debug)
+    thumbnail = _request_album_image(thumbnail_url, debug=debug, timeout=timeout)
 
     _save_album_image(thumbnail, image_path, debug=debug)
     if pdf_a4_path:
@@ -0,0 +1,251 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Callable
+
+PROFILE_MODE_DETERMINISTIC = "deterministic"
+PROFILE_MODE_SAMPLING = "sampling"
+PROFILE_MODES = (PROFILE_MODE_DETERMINISTIC, PROFILE_MODE_SAMPLING)
+
+_deterministic_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Periodically samples the stack of one thread and counts the collapsed stacks.
+
+    With a root frame only the frames called from it are kept, so the thread's bootstrap and the web framework's
+    dispatch frames are left out. The counts can be written in the collapsed-stack format understood by
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id: int | None=None, interval: float=0.005, root: FrameType | None=None):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.root = root
+        self.counts: Counter[str] = Counter()
+        self.elapsed = 0.0
+        self._started = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None and frame is not self.root:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+
+def _format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+def _top_from_stats(stats: pstats.Stats, limit: int) -> list[str]:
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    top = []
+    for (filename, _, func_name), (_, _, _, cumulative_time, _) in entries[:limit]:
+        top.append(f"{Path(filename).stem}:{func_name}={_format_ms(cumulative_time)}")
+    return top
+
+def _top_from_samples(counts: Counter[str], elapsed: float, limit: int) -> list[str]:
+    total = sum(counts.values())
+    # Ranked by self time: the innermost frame of a sample is where the time was actually spent. Every caller
+    # would otherwise show up with the full time of its callees.
+    self_counts: Counter[str] = Counter()
+    for stack, count in counts.items():
+        self_counts[stack.rpartition(";")[2]] += count
+    # Samples are spread over the wall time of the call, so scale the share of each function to it.
+    return [f"{func_name}={_format_ms(elapsed * count / total)}" for func_name, count in self_counts.most_common(limit)]
+
+def write_collapsed(counts: Counter[str], output_path: Path) -> None:
+    with open(output_path, "w", encoding="utf-8") as f:
+        for stack, count in counts.items():
+            f.write(f"{stack} {count}\n")
+
+def read_collapsed(path: Path) -> Counter[str]:
+    counts: Counter[str] = Counter()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                counts[stack] += int(count)
+    return counts
+
+def _aggregate_part_paths(aggregate_path: Path) -> list[Path]:
+    return list(aggregate_path.parent.glob(f"{aggregate_path.stem}.*{aggregate_path.suffix}"))
+
+def _exited_path(aggregate_path: Path) -> Path:
+    return aggregate_path.with_name(f"{aggregate_path.stem}.exited{aggregate_path.suffix}")
+
+def _part_pid(aggregate_path: Path, part_path: Path) -> int | None:
+    name = part_path.name[len(aggregate_path.stem) + 1:-len(aggregate_path.suffix)]
+    pid = name.split("-")[0]
+    return int(pid) if pid.isdigit() else None
+
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CollapsedAggregate:
+    """Sum of the sampled stacks of this process, periodically written to its own part file next to path.
+
+    The part file is rewritten with the folded counts instead of appended to, so it only grows with the number of
+    distinct stacks. A new part file is started after a fork. fold_collapsed merges the parts into path.
+    """
+
+    def __init__(self, path: Path, flush_interval: float=60.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._counts: Counter[str] = Counter()
+        self._pid = os.getpid()
+        self._part_path = self._new_part_path()
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _new_part_path(self) -> Path:
+        # The random part keeps a restarted process that got the same pid from overwriting an old part file.
+        return self.path.with_name(f"{self.path.stem}.{os.getpid()}-{uuid.uuid4().hex[:8]}{self.path.suffix}")
+
+    def add(self, counts: Counter[str]) -> None:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked from the process that created this aggregate, its samples belong to the parent.
+                self._pid = os.getpid()
+                self._part_path = self._new_part_path()
+                self._counts = Counter()
+            self._counts.update(counts)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self._write()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                self._write()
+
+    def _write(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._counts:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._part_path.with_name(self._part_path.name + ".tmp")
+        write_collapsed(self._counts, tmp_path)
+        os.replace(tmp_path, self._part_path)
+
+def fold_collapsed(aggregate_path: Path) -> Counter[str]:
+    """Merges all part files into aggregate_path and returns the merged counts.
+
+    Parts of running processes are still rewritten by them, so they are only read. Parts of processes that have
+    exited are moved into a permanent .exited part and removed.
+    """
+    exited_path = _exited_path(aggregate_path)
+    exited = read_collapsed(exited_path) if exited_path.exists() else Counter()
+    exited_parts = []
+    live: Counter[str] = Counter()
+    for part_path in _aggregate_part_paths(aggregate_path):
+        pid = _part_pid(aggregate_path, part_path)
+        if pid is None:
+            continue
+        if _is_process_alive(pid):
+            live.update(read_collapsed(part_path))
+        else:
+            exited.update(read_collapsed(part_path))
+            exited_parts.append(part_path)
+
+    if exited_parts:
+        tmp_path = exited_path.with_name(f"{exited_path.name}.{os.getpid()}.tmp")
+        write_collapsed(exited, tmp_path)
+        os.replace(tmp_path, exited_path)
+        for part_path in exited_parts:
+            part_path.unlink()
+
+    merged = exited + live
+    tmp_path = aggregate_path.with_name(f"{aggregate_path.name}.{os.getpid()}.tmp")
+    write_collapsed(merged, tmp_path)
+    os.replace(tmp_path, aggregate_path)
+    return merged
+
+def profile_call(func: Callable[[], ...], mode: str, output_dir: Path | None=None,
+                 aggregate: CollapsedAggregate | None=None, interval: float=0.005,
+                 limit: int=5) -> tuple[..., list[str]]:
+    """Runs func under the requested profiler.
+
+    Returns the result of func together with a short summary of the functions with the highest cumulative time
+    (deterministic) or self time (sampling).
+    Per call profiles are written to output_dir, sampled stacks are additionally added to aggregate. Only one
+    deterministic profile runs at a time per process (cProfile cannot run twice at once on Python 3.12+), further
+    ones are sampled instead. Only the calling thread is profiled: work handed to the CPU process pool or to background
+    optional stage threads shows up as time spent waiting for it.
+    """
+    if mode == PROFILE_MODE_DETERMINISTIC and not _deterministic_lock.acquire(blocking=False):
+        mode = PROFILE_MODE_SAMPLING
+
+    if mode == PROFILE_MODE_DETERMINISTIC:
+        try:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(func)
+        finally:
+            _deterministic_lock.release()
+        stats = pstats.Stats(profiler)
+        if output_dir is not None:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(output_dir / "profile.pstats")
+        return result, _top_from_stats(stats, limit)
+
+    if mode == PROFILE_MODE_SAMPLING:
+        with SamplingProfiler(interval=interval, root=sys._getframe()) as sampler:
+            result = func()
+        if output_dir is not None:
+            output_dir.mkdir(parents=True, exist_ok=True)
+            write_collapsed(sampler.counts, output_dir / "profile.folded")
+        if aggregate is not None:
+            aggregate.add(sampler.counts)
+        return result, _top_from_samples(sampler.counts, sampler.elapsed, limit)
+
+    raise ValueError(f"Unknown profile mode: {mode}. Expected one of {PROFILE_MODES}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the top functions of a saved profile")
+    parser.add_argument("profile_path", help="Path to a profile.pstats file or, with --fold, to the aggregate file")
+    parser.add_argument("--fold", action="store_true",
+                        help="Fold the per-process parts of a sampled aggregate (.folded) file into it")
+    parser.add_argument("--limit", type=int, default=20, help="Number of functions to show")
+
+    args = parser.parse_args()
+
+    if args.fold:
+        folded = fold_collapsed(Path(args.profile_path))
+        for line in _top_from_samples(folded, sum(folded.values()) * 0.005, args.limit):
+            print(line)
+    else:
+        pstats.Stats(args.profile_path).sort_stats("cumulative").print_stats(args.limit)
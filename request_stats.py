@@ -0,0 +1,167 @@
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+HOUR = 3600
+DAY = 24 * HOUR
+ROLLUP_TABLES = {"hour": ("requests_hourly", HOUR), "day": ("requests_daily", DAY)}
+
+logger = logging.getLogger("spotify_code_api.request_stats")
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp_str DATETIME DEFAULT CURRENT_TIMESTAMP,
+            timestamp_unix FLOAT,
+            spot_id TEXT,
+            spot_type TEXT
+        )"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_timestamp ON requests (timestamp_unix)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_requests_spot ON requests (spot_type, spot_id)")
+
+    for table, bucket_size in ROLLUP_TABLES.values():
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              (table,)).fetchone()
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                bucket_unix INTEGER NOT NULL,
+                spot_type TEXT NOT NULL,
+                spot_id TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (bucket_unix, spot_type, spot_id)
+            ) WITHOUT ROWID"""
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_type ON {table} (spot_type, bucket_unix)")
+        if not exists:
+            # First start with rollups: fold the existing raw log in once.
+            conn.execute(
+                f"""INSERT INTO {table} (bucket_unix, spot_type, spot_id, count)
+                    SELECT CAST(timestamp_unix / ? AS INTEGER) * ?, spot_type, spot_id, COUNT(*)
+                    FROM requests WHERE timestamp_unix IS NOT NULL GROUP BY 1, 2, 3""",
+                (bucket_size, bucket_size))
+
+def create_schema(db_path: Path, timeout: float=300.0) -> None:
+    """Creates the request log and its rollups, filling new rollups from the raw log.
+
+    Everything happens in one write transaction, so processes starting at the same time neither fill a rollup
+    twice nor log requests into it before it is filled. The fill scans the whole raw log, so this runs once at
+    startup (and may wait long for another process doing it) instead of on the request path.
+    """
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _create_schema(conn)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    return sqlite3.connect(db_path, timeout=3.0)
+
+def _connect_read_only(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(f"{db_path.as_uri()}?mode=ro", uri=True, timeout=3.0)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def log_request(db_path: Path, spotify_id: str, spotify_type: str) -> None:
+    """Appends a request to the raw log and updates the hourly and daily rollups in the same transaction."""
+    now = time.time()
+    conn = _connect(db_path)
+    try:
+        with conn:
+            conn.execute("INSERT INTO requests (timestamp_unix, spot_id, spot_type) VALUES (?, ?, ?)",
+                         (now, spotify_id, spotify_type))
+            for table, bucket_size in ROLLUP_TABLES.values():
+                conn.execute(
+                    f"""INSERT INTO {table} (bucket_unix, spot_type, spot_id, count) VALUES (?, ?, ?, 1)
+                        ON CONFLICT (bucket_unix, spot_type, spot_id) DO UPDATE SET count = count + 1""",
+                    (int(now // bucket_size) * bucket_size, spotify_type, spotify_id))
+    finally:
+        conn.close()
+
+def compact(db_path: Path, retention_days: float=30.0, hourly_retention_days: float=7.0) -> int:
+    """Deletes raw request rows and hourly rollups older than their retention windows.
+
+    The daily rollups keep the counts of the deleted rows. Returns the number of deleted raw rows.
+    """
+    now = time.time()
+    conn = _connect(db_path)
+    try:
+        with conn:
+            cursor = conn.execute("DELETE FROM requests WHERE timestamp_unix < ?", (now - retention_days * DAY,))
+            conn.execute("DELETE FROM requests_hourly WHERE bucket_unix < ?", (now - hourly_retention_days * DAY,))
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+def run_compaction(db_path: Path, stop: threading.Event, retention_days: float=30.0,
+                   hourly_retention_days: float=7.0, interval: float=HOUR) -> None:
+    """Compacts the request log every interval seconds until stop is set. Meant to run in a background thread."""
+    while not stop.wait(interval):
+        try:
+            deleted = compact(db_path, retention_days, hourly_retention_days)
+            if deleted:
+                logger.info(f"Compaction deleted {deleted} raw request rows")
+        except sqlite3.Error as e:
+            logger.error(f"Database error compacting request log: {e}", exc_info=True)
+
+
+def get_top_items(db_path: Path, since_unix: float, spotify_type: str | None=None,
+                  limit: int=10) -> list[dict[str, ...]]:
+    conn = _connect_read_only(db_path)
+    try:
+        query = """SELECT spot_type, spot_id, SUM(count) AS requests FROM requests_daily
+                   WHERE bucket_unix >= ?"""
+        params: list = [int(since_unix // DAY) * DAY]
+        if spotify_type is not None:
+            query += " AND spot_type = ?"
+            params.append(spotify_type)
+        query += " GROUP BY spot_type, spot_id ORDER BY requests DESC LIMIT ?"
+        params.append(limit)
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+def get_request_counts(db_path: Path, granularity: str, since_unix: float) -> list[dict[str, ...]]:
+    if granularity not in ROLLUP_TABLES:
+        raise ValueError(f"Unknown granularity: {granularity}. Expected one of {list(ROLLUP_TABLES)}")
+
+    table, bucket_size = ROLLUP_TABLES[granularity]
+    conn = _connect_read_only(db_path)
+    try:
+        rows = conn.execute(
+            f"""SELECT bucket_unix, spot_type, SUM(count) AS requests FROM {table}
+                WHERE bucket_unix >= ? GROUP BY bucket_unix, spot_type ORDER BY bucket_unix, spot_type""",
+            (int(since_unix // bucket_size) * bucket_size,))
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact the raw request log and print popularity statistics")
+    parser.add_argument("db_path", help="Path to the requests.db")
+    parser.add_argument("--retention-days", type=float, default=30.0, help="Days of raw request rows to keep")
+    parser.add_argument("--hourly-retention-days", type=float, default=7.0, help="Days of hourly rollups to keep")
+    parser.add_argument("--days", type=float, default=7.0, help="Time window for the top items")
+
+    args = parser.parse_args()
+
+    path = Path(args.db_path).resolve()
+    create_schema(path)
+    print(f"Deleted {compact(path, args.retention_days, args.hourly_retention_days)} raw rows older than "
+          f"{args.retention_days} days")
+    for item in get_top_items(path, time.time() - args.days * DAY):
+        print(item)
@@ -0,0 +1,77 @@
+import gzip
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import brotli
+import orjson
+
+RESULT_CACHE_NAME = "result.json"
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz", "identity": ""}
+# Preferred order when the client accepts several encodings with the same weight.
+ENCODING_PREFERENCE = ("br", "gzip", "identity")
+
+
+def dumps_dto(dto) -> bytes:
+    """Serializes a (nested) DTO directly to JSON bytes. orjson handles slotted dataclasses and tuples natively."""
+    return orjson.dumps(dto)
+
+def choose_encoding(accept_encoding: str | None) -> str:
+    if not accept_encoding:
+        return "identity"
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        if params.strip().startswith("q="):
+            try:
+                weight = float(params.strip()[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best = max(ENCODING_PREFERENCE, key=lambda coding: (weights.get(coding, weights.get("*", 0.0)),
+                                                           -ENCODING_PREFERENCE.index(coding)))
+    return best if weights.get(best, weights.get("*", 0.0)) > 0 else "identity"
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=11)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9)
+    return body
+
+
+def _cache_path(job_dir: Path, encoding: str) -> Path:
+    return job_dir / (RESULT_CACHE_NAME + ENCODING_SUFFIXES[encoding])
+
+def write_result_cache(job_dir: Path, body: bytes) -> dict[str, bytes]:
+    """Stores the JSON body of a job result uncompressed and in every supported compression.
+
+    Returns the stored bodies by encoding.
+    """
+    encoded_bodies = {}
+    for encoding in ENCODING_SUFFIXES:
+        encoded_bodies[encoding] = compress(body, encoding)
+        path = _cache_path(job_dir, encoding)
+        # Unique temporary file, as a request and a background completion may write the same job at once.
+        fd, tmp_name = tempfile.mkstemp(dir=job_dir, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(encoded_bodies[encoding])
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+    return encoded_bodies
+
+def read_result_cache(job_dir: Path, encoding: str, ttl: float) -> bytes | None:
+    path = _cache_path(job_dir, encoding)
+    try:
+        if time.time() - path.stat().st_mtime > ttl:
+            return None
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
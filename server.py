@@ -0,0 +1,224 @@
+import gc
+import logging
+import os
+import shutil
+import signal
+import socket
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+logger = logging.getLogger("spotify_code_api.server")
+
+MEMORY_FIELDS = ("Rss", "Pss", "Private_Clean", "Private_Dirty")
+
+
+def _prepare_metrics_dir(metrics_dir: Path) -> None:
+    # prometheus_client reads this when it is imported, so it has to be set before the app is loaded.
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(metrics_dir)
+
+def _load_and_warm_up_app():
+    from fpdf import FPDF
+
+    from core import app
+
+    # Touch the lazily initialized parts of the stacks the workers run in-process so they inherit them ready to use.
+    # Decoding (OpenCV) and color extraction (KMeans) run in each worker's CPU pool instead, whose processes share
+    # one preloaded copy per worker through a forkserver.
+    FPDF(unit="mm", format="A4").add_page()
+    return app
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def read_memory(pid: int) -> dict[str, int]:
+    """Reads the memory totals of a process in bytes. Unique memory (USS) is the private part of the process."""
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+        for line in f:
+            field, _, value = line.partition(":")
+            if field in MEMORY_FIELDS:
+                memory[field] = int(value.split()[0]) * 1024
+    memory["Uss"] = memory.get("Private_Clean", 0) + memory.get("Private_Dirty", 0)
+    return memory
+
+def read_parent_pids() -> dict[int, int]:
+    """Maps the pid of every running process to the pid of its parent."""
+    parents = {}
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_path.read_text(encoding="ascii", errors="replace")
+        except OSError:
+            continue
+        # The command name in parentheses may itself contain spaces and parentheses.
+        fields = stat.rpartition(")")[2].split()
+        parents[int(stat_path.parent.name)] = int(fields[1])
+    return parents
+
+def find_descendants(pid: int, parents: dict[int, int]) -> list[int]:
+    children: dict[int, list[int]] = {}
+    for child, parent in parents.items():
+        children.setdefault(parent, []).append(child)
+
+    descendants = []
+    pending = list(children.get(pid, []))
+    while pending:
+        child = pending.pop()
+        descendants.append(child)
+        pending.extend(children.get(child, []))
+    return descendants
+
+def report_memory(worker_pids: list[int]) -> None:
+    """Logs the memory of every worker and of its CPU pool processes (forkserver, pool workers, resource tracker)."""
+    parents = read_parent_pids()
+    for pid in worker_pids:
+        try:
+            memory = read_memory(pid)
+        except OSError as e:
+            logger.warning(f"Could not read memory of worker {pid}: {e}")
+            continue
+
+        pool_memory = {"Uss": 0, "Pss": 0}
+        pool_processes = 0
+        for child in find_descendants(pid, parents):
+            try:
+                child_memory = read_memory(child)
+            except OSError:
+                continue
+            pool_processes += 1
+            pool_memory["Uss"] += child_memory["Uss"]
+            pool_memory["Pss"] += child_memory.get("Pss", 0)
+
+        logger.info(f"Worker {pid} memory: USS {memory['Uss'] / 2**20:.1f} MiB, "
+                    f"PSS {memory.get('Pss', 0) / 2**20:.1f} MiB, RSS {memory.get('Rss', 0) / 2**20:.1f} MiB, "
+                    f"{pool_processes} CPU pool processes USS {pool_memory['Uss'] / 2**20:.1f} MiB, "
+                    f"PSS {pool_memory['Pss'] / 2**20:.1f} MiB")
+
+
+def _reopen_log_handlers() -> None:
+    """Gives a freshly forked worker its own log file.
+
+    The rotating file handler is inherited from the master, and several processes rotating the same file lose
+    and corrupt lines. The master keeps the original file for its own messages (e.g. the memory reports).
+    """
+    app_logger = logging.getLogger("spotify_code_api")
+    for handler in list(app_logger.handlers):
+        if not isinstance(handler, RotatingFileHandler):
+            continue
+
+        path = Path(handler.baseFilename)
+        worker_handler = RotatingFileHandler(path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}"),
+                                             maxBytes=handler.maxBytes, backupCount=handler.backupCount,
+                                             encoding=handler.encoding)
+        worker_handler.setFormatter(handler.formatter)
+        worker_handler.setLevel(handler.level)
+        app_logger.removeHandler(handler)
+        handler.close()
+        app_logger.addHandler(worker_handler)
+
+def _run_worker(app, sock: socket.socket, log_level: str) -> None:
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    uvicorn.Server(config).run(sockets=[sock])
+
+def _fork_worker(app, sock: socket.socket, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            _reopen_log_handlers()
+            _run_worker(app, sock, log_level)
+        except BaseException:
+            logger.exception("Worker crashed")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+def serve(host: str, port: int, workers: int, metrics_dir: Path, memory_report_interval: float,
+          log_level: str="info") -> None:
+    """Loads and warms the app once in this master process, then forks workers sharing its memory pages.
+
+    Dead workers are replaced, SIGTERM and SIGINT are forwarded to all workers.
+    """
+    _prepare_metrics_dir(metrics_dir)
+    app = _load_and_warm_up_app()
+    from prometheus_client import multiprocess
+
+    sock = _bind_socket(host, port)
+
+    # Keep the garbage collector from touching (and thereby copying) the objects created so far.
+    gc.collect()
+    gc.freeze()
+
+    worker_pids = [_fork_worker(app, sock, log_level) for _ in range(workers)]
+    logger.info(f"Master {os.getpid()} serving on http://{host}:{port} with workers {worker_pids}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker_pid in worker_pids:
+            try:
+                os.kill(worker_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    next_report = time.monotonic() + memory_report_interval
+    while worker_pids:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+
+        if pid == 0:
+            if memory_report_interval > 0 and time.monotonic() >= next_report:
+                report_memory(worker_pids)
+                next_report = time.monotonic() + memory_report_interval
+            time.sleep(0.5)
+            continue
+
+        if pid not in worker_pids:
+            continue
+
+        worker_pids.remove(pid)
+        multiprocess.mark_process_dead(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited, starting a replacement")
+            worker_pids.append(_fork_worker(app, sock, log_level))
+
+    sock.close()
+    logger.info("All workers stopped")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the Spotify Code API with copy-on-write preforked workers")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind to")
+    parser.add_argument("--port", type=int, default=8000, help="Port to bind to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--metrics-dir", default="metrics_multiproc",
+                        help="Directory for the multiprocess Prometheus metrics")
+    parser.add_argument("--memory-report-interval", type=float, default=60.0,
+                        help="Seconds between per-worker memory reports in the log, 0 to disable")
+    parser.add_argument("--log-level", default="info", help="Uvicorn log level")
+
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers, Path(args.metrics_dir).resolve(), args.memory_report_interval,
+          args.log_level)
@@ -0,0 +1,155 @@
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+import requests
+
+from url_conversion import url_to_uri
+from url_to_code_image import _get_request_url as _get_code_request_url
+from url_to_oembed import get_oembed_data
+
+DEFAULT_RECORDING = "default"
+
+
+def _job_id_from_spotify_url(spotify_url: str) -> str:
+    parts = urlparse(spotify_url).path.split("/")
+    if len(parts) < 3:
+        raise ValueError(f"Not a Spotify URL: {spotify_url}")
+    return f"{parts[1]}-{parts[2]}"
+
+def _job_id_from_uri(spotify_uri: str) -> str:
+    parts = unquote(spotify_uri).split(":")
+    if len(parts) != 3:
+        raise ValueError(f"Not a Spotify URI: {spotify_uri}")
+    return f"{parts[1]}-{parts[2]}"
+
+def _recording_path(recordings_dir: Path, kind: str, job_id: str, suffix: str) -> Path:
+    path = recordings_dir / kind / f"{job_id}{suffix}"
+    if path.exists():
+        return path
+    return recordings_dir / kind / f"{DEFAULT_RECORDING}{suffix}"
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Replays recorded oEmbed JSON, Spotify code images and album art with injected latency and errors."""
+
+    recordings_dir: Path = Path("recordings")
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+
+    def do_GET(self) -> None:
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        time.sleep(delay / 1000)
+
+        if random.random() < self.error_rate:
+            self._send(503, b"Injected upstream error", "text/plain")
+            return
+
+        parsed = urlparse(self.path)
+        parts = parsed.path.strip("/").split("/")
+        try:
+            if parts[0] == "oembed":
+                self._serve_oembed(parse_qs(parsed.query).get("url", [""])[0])
+            elif parts[:2] == ["uri", "plain"]:
+                self._serve_file(_recording_path(self.recordings_dir, "code", _job_id_from_uri(parts[-1]), ".jpeg"),
+                                 "image/jpeg")
+            elif parts[0] == "image" and len(parts) == 2:
+                self._serve_file(_recording_path(self.recordings_dir, "album", parts[1], ".jpeg"), "image/jpeg")
+            else:
+                self._send(404, b"Not found", "text/plain")
+        except ValueError as e:
+            self._send(400, str(e).encode(), "text/plain")
+
+    def _serve_oembed(self, spotify_url: str) -> None:
+        job_id = _job_id_from_spotify_url(spotify_url)
+        path = _recording_path(self.recordings_dir, "oembed", job_id, ".json")
+        if not path.exists():
+            self._send(404, b"No oEmbed recording", "text/plain")
+            return
+
+        oembed_data = json.loads(path.read_text(encoding="utf-8"))
+        host = self.headers.get("Host", f"{self.server.server_address[0]}:{self.server.server_address[1]}")
+        oembed_data["thumbnail_url"] = f"http://{host}/image/{job_id}"
+        self._send(200, json.dumps(oembed_data).encode(), "application/json")
+
+    def _serve_file(self, path: Path, content_type: str) -> None:
+        if not path.exists():
+            self._send(404, b"No recording", "text/plain")
+            return
+        self._send(200, path.read_bytes(), content_type)
+
+    def _send(self, status_code: int, body: bytes, content_type: str) -> None:
+        self.send_response(status_code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def record(spotify_url: str, recordings_dir: Path, as_default: bool=False, debug: bool=False) -> None:
+    """Fetches the real upstream responses for a Spotify URL and stores them as recordings."""
+    job_id = DEFAULT_RECORDING if as_default else _job_id_from_spotify_url(spotify_url)
+    for kind in ("oembed", "code", "album"):
+        (recordings_dir / kind).mkdir(parents=True, exist_ok=True)
+
+    oembed_data = get_oembed_data(spotify_url, debug=debug)
+    (recordings_dir / "oembed" / f"{job_id}.json").write_text(json.dumps(oembed_data), encoding="utf-8")
+
+    code_image = requests.get(_get_code_request_url(url_to_uri(spotify_url), debug=debug))
+    code_image.raise_for_status()
+    (recordings_dir / "code" / f"{job_id}.jpeg").write_bytes(code_image.content)
+
+    album_image = requests.get(oembed_data["thumbnail_url"])
+    album_image.raise_for_status()
+    (recordings_dir / "album" / f"{job_id}.jpeg").write_bytes(album_image.content)
+
+    if debug:
+        print(f"Recorded upstream responses for {spotify_url} as {job_id} in {recordings_dir}")
+
+def serve(host: str, port: int, recordings_dir: Path, latency_ms: float=0.0, jitter_ms: float=0.0,
+          error_rate: float=0.0) -> None:
+    StubUpstreamHandler.recordings_dir = recordings_dir
+    StubUpstreamHandler.latency_ms = latency_ms
+    StubUpstreamHandler.jitter_ms = jitter_ms
+    StubUpstreamHandler.error_rate = error_rate
+
+    server = ThreadingHTTPServer((host, port), StubUpstreamHandler)
+    print(f"Stub upstream serving {recordings_dir} on http://{host}:{port}")
+    print(f"Point the API at it with OEMBED_BASE_URL=http://{host}:{port}/oembed "
+          f"and SPOTIFY_CODE_BASE_URL=http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Local stub of the Spotify oEmbed, code image and thumbnail services")
+    parser.add_argument("--recordings", default="recordings", help="Directory with the recorded responses")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind the stub server to")
+    parser.add_argument("--port", type=int, default=8081, help="Port to bind the stub server to")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Mean latency added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Standard deviation of the added latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--record", metavar="SPOTIFY_URL",
+                        help="Record the real upstream responses for this Spotify URL instead of serving")
+    parser.add_argument("--as-default", action="store_true",
+                        help="Store the recording as the fallback for every unknown Spotify ID")
+    parser.add_argument("--debug", action="store_true", help="Enable debug output")
+
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, Path(args.recordings), as_default=args.as_default, debug=args.debug)
+    else:
+        serve(args.host, args.port, Path(args.recordings), args.latency_ms, args.jitter_ms, args.error_rate)
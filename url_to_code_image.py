@@ -1,20 +1,24 @@
+import os
+
 import requests
 from url_conversion import url_to_uri
 
+DEFAULT_SPOTIFY_CODE_BASE_URL = "https://scannables.scdn.co"
+
 def _get_request_url(spotify_uri: str, debug: bool=False) -> str:
     img_format = "jpeg"
     bg_color = "000000"
     code_color = "white"
     size = "640"
-    base_url = "https://scannables.scdn.co/uri/plain"
+    base_url = os.getenv("SPOTIFY_CODE_BASE_URL", DEFAULT_SPOTIFY_CODE_BASE_URL).rstrip("/") + "/uri/plain"
     code_url = f"{base_url}/{img_format}/{bg_color}/{code_color}/{size}/{spotify_uri}"
     result = code_url.replace(" ", "%20")
     if debug:
         print(f"Constructed Spotify Code Request URL: {result}")
     return result
 
-def _request_code_image(code_image_url: str, debug: bool=False) -> bytes:
-    response = requests.get(code_image_url)
+def _request_code_image(code_image_url: str, debug: bool=False, timeout: float | None=None) -> bytes:
+    response = requests.get(code_image_url, timeout=timeout)
     if response.status_code == 200:
         if debug:
             print(f"Successfully retrieved Spotify Code Image from URL: {code_image_url}")
@@ -29,10 +33,10 @@ def _save_spotify_code_image(response_content: bytes, image_path: str, debug: bo
         print(f"Image saved to {image_path}")
 
 
-def save_spotify_code_data(spotify_url: str, image_path: str, debug: bool=False) -> None:
+def save_spotify_code_data(spotify_url: str, image_path: str, debug: bool=False, timeout: float | None=None) -> None:
     uri = url_to_uri(spotify_url)
     request_url = _get_request_url(uri, debug=debug)
-    code_image = _request_code_image(request_url, debug=debug)
+    code_image = _request_code_image(request_url, debug=debug, timeout=timeout)
     _save_spotify_code_image(code_image, image_path, debug=debug)
 
 if __name__ == "__main__":
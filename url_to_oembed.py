@@ -1,17 +1,21 @@
+import os
+
 import requests
 
+DEFAULT_OEMBED_BASE_URL = "https://open.spotify.com/oembed"
+
 
 def _get_request_url(spotify_url: str, debug: bool=False) -> str:
-    base_url = "https://open.spotify.com/oembed?url="
-    oembed_url = base_url + spotify_url
+    base_url = os.getenv("OEMBED_BASE_URL", DEFAULT_OEMBED_BASE_URL).rstrip("/")
+    oembed_url = f"{base_url}?url={spotify_url}"
     result = oembed_url.replace(" ", "%20")
     if debug:
         print(f"Constructed oEmbed Request URL: {result}")
 
     return result
 
-def _request_oembed(oembed_url: str, debug: bool=False) -> dict[str, ...]:
-    response = requests.get(oembed_url)
+def _request_oembed(oembed_url: str, debug: bool=False, timeout: float | None=None) -> dict[str, ...]:
+    response = requests.get(oembed_url, timeout=timeout)
     if response.status_code == 200:
         if debug:
             print(f"Successfully retrieved oEmbed data: {response.json()} from URL: {oembed_url}")
@@ -20,9 +24,9 @@ def _request_oembed(oembed_url: str, debug: bool=False) -> dict[str, ...]:
         raise Exception(f"Failed to retrieve oEmbed data: {response.status_code} - {response.text}")
 
 
-def get_oembed_data(spotify_url: str, debug: bool=False) -> dict[str, ...]:
+def get_oembed_data(spotify_url: str, debug: bool=False, timeout: float | None=None) -> dict[str, ...]:
     oembed_url = _get_request_url(spotify_url, debug)
-    return _request_oembed(oembed_url, debug)
+    return _request_oembed(oembed_url, debug, timeout=timeout)
 
 if __name__ == "__main__":
     import argparse